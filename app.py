@@ -1,25 +1,52 @@
 # app.py — CadQuery/OpenCascade backend for basket stud settings
 # Endpoints:
 #   GET  /health
-#   POST /api/generate        -> STL (attachment)
-#   POST /api/generate/step   -> STEP (attachment)
-
-from flask import Flask, jsonify, request, Response
+#   POST /api/generate         -> STL (attachment)
+#   POST /api/generate/step    -> STEP (attachment)
+#   POST /api/generate/all     -> zip of stud.stl + stud.step, both from one fused build
+#   POST /api/generate/preview -> STL (attachment), fast NumPy approximation for viewers;
+#                                 "format": "glb" returns it as quantized, instanced binary glTF
+#   POST /admin/cache/clear    -> drop memoised models (needs STUD_ADMIN_TOKEN)
+# Optional "lod": "low" | "med" | "high" picks the STL tessellation (default med,
+# low for mobile user agents) and the preview's segment count; STEP is exact
+# B-rep and ignores it. Optional "fuse": true makes /api/generate mesh the single
+# fused solid STEP uses instead of the (faster) compound of overlapping parts.
+# Optional "filletTips": false drops the claw chamfer at the prong tips (STL/STEP
+# only; on by default, it is part of the manufactured shape).
+# Production: gunicorn -c gunicorn.conf.py app:app  (the __main__ block is the dev server)
+
+from flask import Flask, request, Response
 from flask_cors import CORS
 import cadquery as cq
-from cadquery import exporters
-import tempfile, os, math
+from OCP.BRep import BRep_Tool
+from OCP.BRepBuilderAPI import BRepBuilderAPI_Copy, BRepBuilderAPI_Transform
+from OCP.BRepMesh import BRepMesh_IncrementalMesh
+from OCP.BRepTools import BRepTools
+from OCP.gp import gp_Ax1, gp_Dir, gp_Pnt, gp_Trsf
+from OCP.IFSelect import IFSelect_RetDone
+from OCP.Interface import Interface_Static
+from OCP.STEPControl import STEPControl_Writer, STEPControl_AsIs
+from OCP.TopAbs import TopAbs_REVERSED
+from OCP.TopLoc import TopLoc_Location
+from collections import OrderedDict
+from functools import lru_cache, wraps
+from pathlib import Path
+from types import SimpleNamespace
+import numpy as np
+import orjson
+import io, os, math, hashlib, hmac, struct, gzip, threading, zipfile
 
 app = Flask(__name__)
 CORS(app)
 
 # -------------------- helpers --------------------
 
-def _f(d, k, default):  # float
+def _f(d, k, default):  # float; nan/inf fall back to the default like junk does
     try:
-        return float(d.get(k, default))
+        v = float(d.get(k, default))
     except Exception:
         return float(default)
+    return v if math.isfinite(v) else float(default)
 
 def _i(d, k, default):  # int
     try:
@@ -33,51 +60,316 @@ def _b(d, k, default):  # bool
     if isinstance(v, str):  return v.strip().lower() in ("1","true","yes","on")
     return bool(v)
 
-def _export_bytes(shape, kind: str) -> bytes:
-    assert kind in ("stl", "step")
-    suffix = ".stl" if kind == "stl" else ".step"
-    with tempfile.NamedTemporaryFile(suffix=suffix) as tf:
-        if kind == "stl":
-            exporters.export(shape, tf.name, tolerance=0.001, angularTolerance=0.15)
+def _tessellate(shape: cq.Shape, tolerance: float, angular: float):
+    # mesh once in OCCT, then gather every face triangulation into one
+    # preallocated vertex/face buffer (first pass sizes, second pass fills)
+    BRepMesh_IncrementalMesh(shape.wrapped, tolerance, True, angular, True)
+    faces, nv, nt = [], 0, 0
+    for f in shape.Faces():
+        loc = TopLoc_Location()
+        poly = BRep_Tool.Triangulation_s(f.wrapped, loc)
+        if poly is None:
+            continue
+        faces.append((f, poly, loc))
+        nv += poly.NbNodes()
+        nt += poly.NbTriangles()
+
+    V = np.empty((nv, 3), np.float32)
+    F = np.empty((nt, 3), np.int32)
+    vo = to = 0
+    for f, poly, loc in faces:
+        n, m = poly.NbNodes(), poly.NbTriangles()
+        P = np.array([poly.Node(i).Coord() for i in range(1, n+1)])
+        if not loc.IsIdentity():
+            # place the face with one affine matmul instead of a gp_Pnt per node
+            T = loc.Transformation()
+            M = np.array([[T.Value(r, c) for c in (1, 2, 3, 4)] for r in (1, 2, 3)])
+            P = P @ M[:, :3].T + M[:, 3]
+        V[vo:vo+n] = P
+        tri = np.array([poly.Triangle(i).Get() for i in range(1, m+1)], np.int32)
+        if f.wrapped.Orientation() == TopAbs_REVERSED:
+            tri = tri[:, ::-1]
+        F[to:to+m] = tri + (vo - 1)  # OCCT node indices are 1-based
+        vo += n
+        to += m
+    return V, F
+
+_STL_HEADER = b"jewelcad-backend binary STL".ljust(80, b"\0")
+_STL_DTYPE  = np.dtype([("n", "<f4", 3), ("v", "<f4", (3, 3)), ("attr", "<u2")])  # 50-byte record
+
+def _stl_bytes(V: np.ndarray, F: np.ndarray) -> bytes:
+    # the size is fixed (84 + 50*T): fill the records in place in the final buffer
+    buf = bytearray(84 + _STL_DTYPE.itemsize*len(F))
+    buf[:80] = _STL_HEADER
+    struct.pack_into("<I", buf, 80, len(F))
+    rec = np.frombuffer(buf, _STL_DTYPE, offset=84)      # every field is written below
+    tri = rec["v"]                                       # (T, 3, 3) view into the records
+    np.take(np.asarray(V, np.float32), F, axis=0, out=tri, mode="clip")  # gather corners in place
+    n = np.cross(tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0])
+    ln = np.linalg.norm(n, axis=1, keepdims=True)
+    n /= np.where(ln > 0, ln, 1)                         # degenerate slivers keep a zero normal
+    rec["n"] = n
+    rec["attr"] = 0
+    return bytes(buf)
+
+def _glb_bytes(plan) -> bytes:
+    # binary glTF for web viewers, instanced: one mesh per part template and one node
+    # per placed copy, so the n prongs (and struts) share a single mesh. Positions are
+    # int16 (KHR_mesh_quantization, 8 bytes a vertex with stride padding) that each
+    # node's matrix maps back to mm; no normals (viewers derive flat ones)
+    blobs, views, accessors, meshes, nodes = [], [], [], [], []
+    offset = 0
+
+    def view(data: bytes, **kw) -> int:
+        nonlocal offset
+        views.append({"buffer": 0, "byteOffset": offset, "byteLength": len(data), **kw})
+        blobs.append(data + b"\0" * (-len(data) % 4))   # keep every view 4-byte aligned
+        offset += len(blobs[-1])
+        return len(views) - 1
+
+    for Vu, Fu, Ms in plan:
+        lo, hi = Vu.min(0).astype(np.float64), Vu.max(0).astype(np.float64)
+        s = np.maximum(hi - lo, 1e-9) / 65535.0
+        q = np.zeros((len(Vu), 4), "<i2")                # xyz + pad: strides are 4-byte aligned
+        q[:, :3] = np.rint((Vu - lo) / s) - 32768
+        small = len(Vu) < 65535                          # 65535 is the u16 restart value
+        accessors.append({"bufferView": view(q.tobytes(), byteStride=8, target=34962),
+                          "componentType": 5122, "count": len(Vu), "type": "VEC3",
+                          "min": q[:, :3].min(0).tolist(), "max": q[:, :3].max(0).tolist()})
+        accessors.append({"bufferView": view(Fu.astype("<u2" if small else "<u4").tobytes(), target=34963),
+                          "componentType": 5123 if small else 5125, "count": Fu.size, "type": "SCALAR"})
+        meshes.append({"primitives": [{"attributes": {"POSITION": len(accessors) - 2},
+                                       "indices": len(accessors) - 1}]})
+        # int16 -> template units -> placed copy -> Z up to Y up; glTF matrices are
+        # column-major float32, which orjson writes in shortest form (the JSON is per node)
+        for M in (_ZY4 @ Ms @ _compose(s, lo + 32768*s)).astype(np.float32):
+            nodes.append({"mesh": len(meshes) - 1, "matrix": M.T.ravel()})
+
+    binary = b"".join(blobs)
+    gltf = {
+        "asset": {"version": "2.0", "generator": "jewelcad-backend"},
+        "extensionsUsed": ["KHR_mesh_quantization"],
+        "extensionsRequired": ["KHR_mesh_quantization"],
+        "scene": 0,
+        "scenes": [{"nodes": list(range(len(nodes)))}],
+        "nodes": nodes,
+        "meshes": meshes,
+        "buffers": [{"byteLength": len(binary)}],
+        "bufferViews": views,
+        "accessors": accessors,
+    }
+    js = orjson.dumps(gltf, option=orjson.OPT_SERIALIZE_NUMPY)
+    js += b" " * (-len(js) % 4)
+    return b"".join([
+        struct.pack("<4sII", b"glTF", 2, 28 + len(js) + len(binary)),
+        struct.pack("<II", len(js), 0x4E4F534A), js,          # JSON chunk
+        struct.pack("<II", len(binary), 0x004E4942), binary,  # BIN chunk
+    ])
+
+# STL level of detail -> (linear tolerance mm, angular tolerance rad)
+_LOD = {
+    "low":  (0.01,  0.5),
+    "med":  (0.003, 0.2),
+    "high": (0.001, 0.1),
+}
+# preview mesh chord error (mm) per lod; each circle gets the segment count that keeps
+# it within that, so the ~0.5 mm wires get far fewer facets than the ~7 mm band
+_LOD_CHORD = {"low": 0.03, "med": 0.008, "high": 0.002}
+
+def _sections_for(radius: float, chord_err: float) -> int:
+    # segments so the chord sagitta r*(1 - cos(pi/n)) stays under chord_err; rounded up
+    # to a multiple of 4 so nearby radii share cached templates
+    c = 1.0 - chord_err / max(radius, chord_err)
+    n = math.pi / math.acos(max(-1.0, c)) if c < 1.0 else 256
+    return min(256, max(8, 4*math.ceil(n / 4)))
+
+def _json(obj) -> Response:
+    return Response(orjson.dumps(obj), mimetype="application/json")
+
+def _payload() -> dict:
+    # request body as a dict; anything unparsable means "all defaults"
+    try:
+        p = orjson.loads(request.get_data() or b"{}")
+    except orjson.JSONDecodeError:
+        return {}
+    return p if isinstance(p, dict) else {}
+
+def _step_bytes(shape: cq.Shape) -> bytes:
+    # same settings as Shape.exportStep, but written to memory instead of a path
+    writer = STEPControl_Writer()
+    Interface_Static.SetIVal_s("write.surfacecurve.mode", 1)
+    Interface_Static.SetIVal_s("write.precision.mode", 0)
+    writer.Transfer(shape.wrapped, STEPControl_AsIs)
+    buf = io.BytesIO()
+    if writer.WriteStream(buf) != IFSelect_RetDone:
+        raise RuntimeError("STEP export failed")
+    return buf.getvalue()
+
+# BRepMesh stores triangulations on the (shared, cached) faces themselves: meshing
+# must be serialised, and stale ones dropped or a coarser lod keeps the finer mesh
+_MESH_LOCK = threading.Lock()
+
+def _export_bytes(shape, kind: str, lod: str = "med") -> bytes:
+    if kind == "stl":
+        with _MESH_LOCK:
+            BRepTools.Clean_s(shape.val().wrapped)
+            V, F = _tessellate(shape.val(), *_LOD[lod])
+        return _stl_bytes(V, F)
+    if kind == "step":
+        return _step_bytes(shape.val())
+    raise ValueError(f"unknown export kind: {kind}")
+
+# payload fields the geometry depends on, with the _dims attribute each resolves
+# into (bridgeThickMm is parsed but no part uses it yet, so it stays out of the key)
+_PARAMS = {
+    "stoneDiameterMm": "stone_d", "seatClearanceMm": "seat_clear",
+    "rimWallThicknessMm": "rim_wall", "rimHeightMm": "rim_h", "seatDropMm": "seat_drop",
+    "prongCount": "prong_n", "prongHeelDiaMm": "prong_heel", "prongTipDiaMm": "prong_tip",
+    "prongHeightMm": "prong_h", "prongTiltDeg": "prong_tilt",
+    "galleryDropMm": "gallery_drop", "galleryHeightMm": "gallery_h",
+    "bridgeWidthMm": "bridge_w",
+    "postDiameterMm": "post_d", "postLengthMm": "post_len",
+    "addSeatCrossRails": "add_cross", "filletTips": "fillet_tips",
+}
+
+def _params_key(p: dict) -> tuple:
+    # canonical, hashable view of a payload: every field the build reads, resolved
+    # by _dims itself (coercion, junk and nan/inf -> default, and defaults that
+    # depend on other fields such as addSeatCrossRails), so 4, 4.0, "4" and an
+    # omitted prongCount all share one entry. Fixed key order, rounded floats
+    d = _dims(p)
+    items = {k: getattr(d, attr) for k, attr in _PARAMS.items()}
+    items["fuse"] = _b(p, "fuse", False)
+    return tuple((k, round(v, 4) if isinstance(v, float) else v) for k, v in sorted(items.items()))
+
+# the export caches are bounded by the bytes they hold, not by entry count: a
+# fused high-lod STL is ~4 MB, a preview ~0.1 MB. Per worker, STUD_CACHE_MB
+# (default 64) for raw exports plus half that for their gzip copies
+_CACHE_BYTES = int(os.environ.get("STUD_CACHE_MB", "64")) << 20
+
+def _bytes_lru(max_bytes: int):
+    # lru_cache for functions returning (payload, etag), evicting least recently
+    # used entries once the payloads add up to max_bytes. Same cache_info() /
+    # cache_clear() surface; like lru_cache, it computes outside its lock
+    def deco(fn):
+        entries, lock = OrderedDict(), threading.Lock()
+        stats = {"hits": 0, "misses": 0, "bytes": 0}
+
+        @wraps(fn)
+        def wrapper(*key):
+            with lock:
+                if key in entries:
+                    entries.move_to_end(key)
+                    stats["hits"] += 1
+                    return entries[key]
+                stats["misses"] += 1
+            value = fn(*key)
+            size = len(value[0])
+            with lock:
+                if key not in entries and size <= max_bytes:
+                    entries[key] = value
+                    stats["bytes"] += size
+                    while stats["bytes"] > max_bytes:
+                        stats["bytes"] -= len(entries.popitem(last=False)[1][0])
+            return value
+
+        def cache_info():
+            with lock:
+                return SimpleNamespace(**stats, maxbytes=max_bytes, currsize=len(entries))
+
+        def cache_clear():
+            with lock:
+                entries.clear()
+                stats.update(hits=0, misses=0, bytes=0)
+
+        wrapper.cache_info, wrapper.cache_clear = cache_info, cache_clear
+        return wrapper
+    return deco
+
+# OCCT's booleans order the result's faces and edges by shape addresses, so the
+# fused solid, and every file written from it, can differ byte-wise between workers
+# and rebuilds while describing the same design. Those kinds get a weak ETag from
+# the design and this deployment (code + kernel version) instead of the bytes
+_BUILD_TAG = hashlib.blake2b(Path(__file__).read_bytes() + cq.__version__.encode(), digest_size=8).digest()
+
+def _fused(key: tuple, kind: str) -> bool:
+    return kind in ("step", "zip") or (kind == "stl" and dict(key).get("fuse", False))
+
+@lru_cache(maxsize=32)
+def _cached_solid(key: tuple, fuse: bool) -> cq.Workplane:
+    # the OCCT build is shared by every lod of the same params
+    return build_stud(dict(key), fuse=fuse)
+
+@_bytes_lru(_CACHE_BYTES)
+def _cached_export(key: tuple, kind: str, lod: str):
+    # identical params -> identical bytes, so memoize the whole build + export
+    if kind in ("preview", "glb"):
+        if kind == "glb":
+            data = _glb_bytes(_mesh_plan(dict(key), lod))
         else:
-            exporters.export(shape, tf.name)  # STEP
-        tf.seek(0)
-        return tf.read()
+            data = _stl_bytes(*build_stud_mesh(dict(key), lod))
+    elif kind == "zip":
+        # the STL meshes the fused solid so both files come off one cached build;
+        # run one after the other: OCP holds the GIL and meshing writes
+        # triangulations onto the very faces the STEP writer walks
+        stl, _ = _cached_export(_params_key({**dict(key), "fuse": True}), "stl", lod)
+        step, _ = _cached_export(key, "step", None)
+        buf = io.BytesIO()
+        with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+            for name, body in (("stud.stl", stl), ("stud.step", step)):
+                # fixed member dates (writestr stamps "now"): same bytes, same ETag on every worker
+                zf.writestr(zipfile.ZipInfo(name, date_time=(2000, 1, 1, 0, 0, 0)), body,
+                            compress_type=zipfile.ZIP_DEFLATED)
+        data = buf.getvalue()
+    else:
+        # "fuse" picks the solid, not the design: the compound and fused builds
+        # share one solid cache key
+        data = _export_bytes(_cached_solid(tuple(i for i in key if i[0] != "fuse"), _fused(key, kind)), kind, lod)
+    tagged = repr((key, kind, lod)).encode() + _BUILD_TAG if _fused(key, kind) else data
+    return data, hashlib.blake2b(tagged, digest_size=16).hexdigest()
+
+@_bytes_lru(_CACHE_BYTES // 2)
+def _cached_gzip(key: tuple, kind: str, lod: str):
+    # gzip variant, compressed once per entry on first demand; own ETag
+    # because it is a different representation of the same model
+    data, etag = _cached_export(key, kind, lod)
+    return gzip.compress(data, compresslevel=6), etag + "-gz"
 
 # -------------------- CAD core --------------------
 
-def build_stud(p: dict) -> cq.Workplane:
-    # ----- primary inputs (mm) -----
-    stone_d      = _f(p, "stoneDiameterMm",        6.0)
-    seat_clear   = _f(p, "seatClearanceMm",        0.15)  # radial clearance to stone
-    rim_wall     = _f(p, "rimWallThicknessMm",     0.80)  # outer wall thickness (radial)
-    rim_h        = _f(p, "rimHeightMm",            1.20)
-    seat_drop    = _f(p, "seatDropMm",             0.18)  # vertical drop of seat from rim top
-
-    prong_n      = _i(p, "prongCount",             4)
-    prong_heel   = _f(p, "prongHeelDiaMm",         0.90)  # diameter at heel
-    prong_tip    = _f(p, "prongTipDiaMm",          0.68)  # diameter near tip
-    prong_h      = _f(p, "prongHeightMm",          2.8)
-    prong_tilt   = _f(p, "prongTiltDeg",           22.0)
-
-    gallery_drop = _f(p, "galleryDropMm",          1.20)  # distance from rim mid-plane to lower ring mid-plane
-    gallery_h    = _f(p, "galleryHeightMm",        0.80)
-    bridge_w     = _f(p, "bridgeWidthMm",          0.80)
-    bridge_t     = _f(p, "bridgeThickMm",          0.70)
+_Z_TO_Y = cq.Location(cq.Vector(0, 0, 0), cq.Vector(1, 0, 0), -90)
 
-    post_d       = _f(p, "postDiameterMm",         0.95)
-    post_len     = _f(p, "postLengthMm",           10.0)
+@lru_cache(maxsize=32)
+def _prong_unit(rim_outer, heel_z, heel_r, tip_r, prong_h, prong_tilt, fillet_tips=True) -> cq.Shape:
+    # one tapered, tilted prong on +X; loft + chamfer is the costly
+    # part of the prong ring, and clients mostly vary other parameters
+    prong_proto = (
+        cq.Workplane("XY")
+          .center(rim_outer, 0)
+          .circle(heel_r)
+          .workplane(offset=prong_h)
+          .center(0,0)
+          .circle(tip_r)
+          .loft()
+          .translate((0,0,heel_z))
+          .rotate((rim_outer,0,heel_z),(rim_outer,1,heel_z), -prong_tilt)  # tilt inward about local tangent (Y at +X)
+    )
 
-    add_cross    = _b(p, "addSeatCrossRails",      stone_d < 5.0)  # default on for small stones
+    # tiny claw facet: cut a shallow chamfer plane at the very tip (a few ms on a
+    # cold prong, nothing once cached). No heel fillet: the tilted loft has no
+    # "|Z" edges to select, so it never applied
+    if fillet_tips:
+        try:
+            prong_proto = prong_proto.faces(">Z").chamfer(min(0.10, 0.70*tip_r))
+        except Exception:
+            pass
 
-    # ----- derived geometry -----
-    seat_r       = max(0.8, 0.5*stone_d - seat_clear)          # seat radius (stone sits here)
-    rim_inner    = max(1.2, seat_r - 0.10)                     # tiny bearing under girdle
-    rim_outer    = rim_inner + rim_wall                        # outer band radius
-    rim_top_z    = +0.5*rim_h
-    rim_bot_z    = -0.5*rim_h
+    return prong_proto.val()
 
-    # ----- 1) Rim ring with inner seat ledge -----
+# the rim, gallery, strut and post only depend on a few inputs each, so a request
+# that changes e.g. the prong count or the post reuses the rest
+@lru_cache(maxsize=32)
+def _rim_solid(rim_outer, rim_inner, rim_h, seat_r, seat_drop) -> cq.Shape:
     rim = (
         cq.Workplane("XY")
           .circle(rim_outer)
@@ -90,7 +382,7 @@ def build_stud(p: dict) -> cq.Workplane:
         cq.Workplane("XY")
           .circle(seat_r)
           .extrude(seat_drop)
-          .translate((0,0,rim_top_z - seat_drop))
+          .translate((0,0,0.5*rim_h - seat_drop))
     )
     rim = rim.cut(seat_cut)
 
@@ -99,137 +391,425 @@ def build_stud(p: dict) -> cq.Workplane:
         rim = rim.edges(">Z or <Z").fillet(0.08)
     except Exception:
         pass
+    return rim.val()
 
-    body = rim
-
-    # ----- 2) Lower gallery ring -----
-    gal_mid_z = -gallery_drop
-    gallery = (
+@lru_cache(maxsize=32)
+def _gallery_solid(rim_inner, ring_w, gallery_h, gal_bot_z) -> cq.Shape:
+    return (
         cq.Workplane("XY")
           .circle(rim_inner)       # similar ID as seat ledge region
-          .offset2D(rim_wall*0.65) # slim ring
+          .offset2D(ring_w)        # slim ring
           .extrude(gallery_h)
-          .translate((0,0,gal_mid_z - 0.5*gallery_h))
-    )
-    body = body.union(gallery)
-
-    # ----- 3) Inter-prong bridges (straight struts for now) -----
-    # Place them halfway between prongs: offset angle = 180/prong_n
-    inter_step = 360.0/prong_n
-    half = 0.5*inter_step
-    for k in range(prong_n):
-        ang = k*inter_step + half
-        # local plane facing outward at angle ang
-        wp = (
-            cq.Workplane("XY")
-              .transformed(rotate=(0,0,ang))
-        )
-        # rectangular strut from gallery ring to rim band
-        span_z = (rim_bot_z + 0.20, gal_mid_z + 0.5*gallery_h)  # bottom to top approx
-        z0, z1 = min(span_z), max(span_z)
-        strut_len = rim_outer - (rim_inner-0.10)
-        strut = (
-            wp.center(rim_inner-0.10 + 0.5*strut_len, 0)
-              .box(strut_len, bridge_w, (z1-z0)+0.2, centered=(True, True, True))
-              .translate((0,0,0.5*(z0+z1)))
-        )
-        try:
-            strut = strut.edges("|Z").fillet(min(0.25, 0.5*bridge_w))
-        except Exception:
-            pass
-        body = body.union(strut)
+          .translate((0,0,gal_bot_z))
+    ).val()
 
-    # ----- 4) Prongs (tapered), evenly spaced, with inward tilt -----
-    heel_r = 0.5*prong_heel
-    tip_r  = 0.5*prong_tip
-    heel_z = rim_top_z - 0.05  # heel meets near top outer edge
-    tip_z  = heel_z + prong_h
-
-    prong_proto = (
+@lru_cache(maxsize=32)
+def _strut_unit(strut_x, strut_len, bridge_w, strut_h, strut_zmid) -> cq.Shape:
+    # rectangular strut from gallery ring to rim band, built once on +X
+    strut = (
         cq.Workplane("XY")
-          .center(rim_outer, 0)
-          .circle(heel_r)
-          .workplane(offset=prong_h)
-          .center(0,0)
-          .circle(tip_r)
-          .loft()
-          .translate((0,0,heel_z))
-          .rotate((rim_outer,0,heel_z),(rim_outer,1,heel_z), -prong_tilt)  # tilt inward about local tangent (Y at +X)
+          .center(strut_x, 0)
+          .box(strut_len, bridge_w, strut_h, centered=(True, True, True))
+          .translate((0,0,strut_zmid))
     )
-
-    # tiny claw facet: cut a shallow chamfer plane at the very tip
     try:
-        prong_proto = prong_proto.faces(">Z").chamfer(min(0.10, 0.35*prong_tip))
+        strut = strut.edges("|Z").fillet(min(0.25, 0.5*bridge_w))
     except Exception:
         pass
+    return strut.val()
 
-    # heel blend: small fillet where heel meets outer rim
-    try:
-        prong_proto = prong_proto.edges("|Z").fillet(0.10)
-    except Exception:
-        pass
+@lru_cache(maxsize=32)
+def _post_solid(post_r, post_len, gal_bot_z) -> cq.Shape:
+    return (
+        cq.Workplane("XY")
+          .circle(post_r)
+          .extrude(post_len)
+          .translate((0,0,gal_bot_z))  # start near gallery plane
+    ).val()
+
+def _own(shape: cq.Shape) -> cq.Shape:
+    # private copy of a cached shape, for booleans that touch their inputs
+    return cq.Shape.cast(BRepBuilderAPI_Copy(shape.wrapped).Shape())
+
+@lru_cache(maxsize=16)
+def _rotations(n: int, offset_deg: float = 0.0) -> tuple:
+    # n evenly spaced rotations about Z; the trig runs once per (n, offset)
+    axis = gp_Ax1(gp_Pnt(0, 0, 0), gp_Dir(0, 0, 1))
+    out = []
+    for k in range(n):
+        t = gp_Trsf()
+        t.SetRotation(axis, math.radians(offset_deg + k*360.0/n))
+        out.append(t)
+    return tuple(out)
+
+def _polar(unit: cq.Shape, n: int, offset_deg: float = 0.0) -> cq.Compound:
+    # n rotated instances about Z via OCCT transforms; Copy=False lets the
+    # instances share one geometry. unit may come from a cache shared across
+    # requests and booleans can touch input tolerances in place, so the
+    # instances hang off a private copy
+    base = _own(unit).wrapped
+    return cq.Compound.makeCompound([
+        cq.Shape.cast(BRepBuilderAPI_Transform(base, t, False).Shape())
+        for t in _rotations(n, offset_deg)
+    ])
+
+def _dims(p: dict) -> SimpleNamespace:
+    # every input and placement number both builders (B-rep and preview) share
+    d = SimpleNamespace()
+    # ----- primary inputs (mm) -----
+    d.stone_d      = _f(p, "stoneDiameterMm",        6.0)
+    d.seat_clear   = _f(p, "seatClearanceMm",        0.15)  # radial clearance to stone
+    d.rim_wall     = _f(p, "rimWallThicknessMm",     0.80)  # outer wall thickness (radial)
+    d.rim_h        = _f(p, "rimHeightMm",            1.20)
+    d.seat_drop    = _f(p, "seatDropMm",             0.18)  # vertical drop of seat from rim top
+
+    d.prong_n      = _i(p, "prongCount",             4)
+    d.prong_heel   = _f(p, "prongHeelDiaMm",         0.90)  # diameter at heel
+    d.prong_tip    = _f(p, "prongTipDiaMm",          0.68)  # diameter near tip
+    d.prong_h      = _f(p, "prongHeightMm",          2.8)
+    d.prong_tilt   = _f(p, "prongTiltDeg",           22.0)
+
+    d.gallery_drop = _f(p, "galleryDropMm",          1.20)  # distance from rim mid-plane to lower ring mid-plane
+    d.gallery_h    = _f(p, "galleryHeightMm",        0.80)
+    d.bridge_w     = _f(p, "bridgeWidthMm",          0.80)
+    d.bridge_t     = _f(p, "bridgeThickMm",          0.70)
+
+    d.post_d       = _f(p, "postDiameterMm",         0.95)
+    d.post_len     = _f(p, "postLengthMm",           10.0)
+
+    d.add_cross    = _b(p, "addSeatCrossRails",      d.stone_d < 5.0)  # default on for small stones
+    d.fillet_tips  = _b(p, "filletTips",             True)            # B-rep only
 
-    step = 360.0/prong_n
-    prongs = cq.Workplane("XY")
-    unit = prong_proto.val()
-    for a in [i*step for i in range(prong_n)]:
-        prongs = prongs.add(unit.rotate((0,0,0),(0,0,1), a))
-    prongs = prongs.combineSolids()
-    body = body.union(prongs)
+    # ----- derived geometry -----
+    d.seat_r       = max(0.8, 0.5*d.stone_d - d.seat_clear)   # seat radius (stone sits here)
+    d.rim_inner    = max(1.2, d.seat_r - 0.10)                # tiny bearing under girdle
+    d.rim_outer    = d.rim_inner + d.rim_wall                 # outer band radius
+    d.rim_top_z    = +0.5*d.rim_h
+    d.rim_bot_z    = -0.5*d.rim_h
+
+    d.gal_mid_z    = -d.gallery_drop
+    d.gal_r        = d.rim_inner + d.rim_wall*0.65            # gallery disc radius
+    d.gal_bot_z    = d.gal_mid_z - 0.5*d.gallery_h
+
+    # strut from gallery ring to rim band, on +X before the polar array
+    span_z         = (d.rim_bot_z + 0.20, d.gal_mid_z + 0.5*d.gallery_h)  # bottom to top approx
+    d.strut_z0, d.strut_z1 = min(span_z), max(span_z)
+    d.strut_len    = d.rim_outer - (d.rim_inner-0.10)
+    d.strut_x      = d.rim_inner-0.10 + 0.5*d.strut_len
+    d.strut_h      = (d.strut_z1-d.strut_z0) + 0.2
+
+    d.heel_r       = 0.5*d.prong_heel
+    d.tip_r        = 0.5*d.prong_tip
+    d.heel_z       = d.rim_top_z - 0.05  # heel meets near top outer edge
+
+    d.rail_w       = 0.70
+    d.rail_h       = 0.60
+    d.rail_len     = 2.0*d.rim_inner*0.96
+    d.rail_z       = d.rim_top_z - d.seat_drop - 0.12
+    return d
+
+def build_stud(p: dict, fuse: bool = True) -> cq.Workplane:
+    # fuse=False skips the booleans and returns a compound of overlapping
+    # parts; fine for STL (viewers/slicers), STEP consumers expect one solid
+    d = _dims(p)
+
+    # ----- 1) Rim ring with inner seat ledge -----
+    # ----- 2) Lower gallery ring -----
+    parts = [_rim_solid(d.rim_outer, d.rim_inner, d.rim_h, d.seat_r, d.seat_drop),
+             _gallery_solid(d.rim_inner, d.rim_wall*0.65, d.gallery_h, d.gal_bot_z)]
+
+    # ----- 3) Inter-prong bridges (straight struts for now) -----
+    # Place them halfway between prongs: offset angle = 180/prong_n
+    strut = _strut_unit(d.strut_x, d.strut_len, d.bridge_w, d.strut_h, 0.5*(d.strut_z0+d.strut_z1))
+    parts.append(_polar(strut, d.prong_n, 180.0/d.prong_n))
+
+    # ----- 4) Prongs (tapered), evenly spaced, with inward tilt -----
+    unit = _prong_unit(d.rim_outer, d.heel_z, d.heel_r, d.tip_r, d.prong_h, d.prong_tilt, d.fillet_tips)
+    parts.append(_polar(unit, d.prong_n))
 
     # ----- 5) Optional seat cross rails (useful for small stones) -----
-    if add_cross:
-        rail_w = 0.70
-        rail_h = 0.60
-        rail_len = 2.0*rim_inner*0.96
-        z_pos = rim_top_z - seat_drop - 0.12
-        rx = cq.Workplane("XY").box(rail_len, rail_w, rail_h).translate((0,0,z_pos))
-        ry = cq.Workplane("XY").box(rail_w, rail_len, rail_h).translate((0,0,z_pos))
-        body = body.union(rx).union(ry)
+    if d.add_cross:
+        rx = cq.Workplane("XY").box(d.rail_len, d.rail_w, d.rail_h).translate((0,0,d.rail_z))
+        ry = cq.Workplane("XY").box(d.rail_w, d.rail_len, d.rail_h).translate((0,0,d.rail_z))
+        parts += [rx.val(), ry.val()]
 
     # ----- 6) Post (axial) -----
-    post = (
-        cq.Workplane("XY")
-          .circle(0.5*post_d)
-          .extrude(post_len)
-          .translate((0,0,gal_mid_z - 0.5*gallery_h))  # start near gallery plane
-    )
-    body = body.union(post)
+    parts.append(_post_solid(0.5*d.post_d, d.post_len, d.gal_bot_z))
 
-    # ----- 7) Orient for viewer: basket axis +Y, post +Y -----
-    # We built along +Z; rotate so Z->Y
-    body = body.rotate((0,0,0), (1,0,0), -90)
+    if fuse:
+        # one n-ary BRepAlgoAPI_Fuse (args + tool list) instead of a union per part;
+        # the cached solids go in as private copies, like _polar's instances
+        parts[0], parts[1], parts[-1] = _own(parts[0]), _own(parts[1]), _own(parts[-1])
+        body = parts[0].fuse(*parts[1:]).clean()
+    else:
+        body = cq.Compound.makeCompound(parts)
 
-    return body
+    # ----- 7) Orient for viewer: basket axis +Y, post +Y -----
+    # We built along +Z; rotate so Z->Y. Applied as a location rather than a
+    # transformed B-rep copy; _tessellate folds it into its per-face matmul
+    return cq.Workplane("XY").add(body.moved(_Z_TO_Y))
+
+# -------------------- preview mesh (NumPy) --------------------
+# Viewer-only approximation of build_stud assembled from closed primitive
+# meshes: no booleans, fillets or chamfers, same frame and dimensions.
+# Milliseconds instead of an OCCT build + tessellation.
+
+@lru_cache(maxsize=64)
+def _ring(sections: int) -> np.ndarray:
+    # (sections, 2) unit circle, read-only so it can be shared across requests
+    a = np.linspace(0, 2*np.pi, sections, endpoint=False)
+    R = np.column_stack([np.cos(a), np.sin(a)]).astype(np.float32)
+    R.flags.writeable = False
+    return R
+
+@lru_cache(maxsize=64)
+def _cyl_faces(sections: int) -> np.ndarray:
+    i = np.arange(sections)
+    j = (i + 1) % sections
+    bc = np.full(sections, 2*sections)
+    tc = bc + 1
+    F = np.concatenate([
+        np.column_stack([i, j, j + sections]),            # side
+        np.column_stack([i, j + sections, i + sections]),
+        np.column_stack([bc, j, i]),                      # bottom cap
+        np.column_stack([tc, i + sections, j + sections]),  # top cap
+    ])
+    F.flags.writeable = False
+    return F
+
+@lru_cache(maxsize=64)
+def _lathe_faces(sections: int, points: int) -> np.ndarray:
+    # quad strip between consecutive rings of a closed profile loop; ring p is
+    # vertices p*sections.. and the loop runs up the outside, so normals face out
+    i = np.arange(sections)
+    j = (i + 1) % sections
+    F = np.concatenate([
+        np.concatenate([np.column_stack([a+i, a+j, b+j]), np.column_stack([a+i, b+j, b+i])])
+        for a, b in ((sections*p, sections*((p + 1) % points)) for p in range(points))
+    ])
+    F.flags.writeable = False
+    return F
+
+def _cyl_arrays(sections: int, top: float = 1.0):
+    # closed unit cylinder on +Z: radius 1 at z=0, radius `top` at z=1; cap centres last
+    n, R = sections, _ring(sections)
+    V = np.zeros((2*n + 2, 3), np.float32)
+    V[:n, :2] = R
+    V[n:2*n, :2] = R
+    V[n:2*n, :2] *= top
+    V[n:2*n, 2] = V[-1, 2] = 1.0
+    return V, _cyl_faces(n)
+
+def _lathe_arrays(sections: int, profile):
+    # closed solid of revolution about +Z from a loop of (r, z) points, r > 0
+    # (no caps to close): a ring of `sections` vertices per profile point
+    n, R = sections, _ring(sections)
+    V = np.empty((len(profile)*n, 3), np.float32)
+    for p, (r, z) in enumerate(profile):
+        V[p*n:(p+1)*n, :2] = R * r
+        V[p*n:(p+1)*n, 2] = z
+    return V, _lathe_faces(n, len(profile))
+
+# closed unit box centred on the origin; vertex k = 4*x + 2*y + z bits
+_BOX_V = np.array([[x, y, z] for x in (-0.5, 0.5) for y in (-0.5, 0.5) for z in (-0.5, 0.5)], np.float32)
+_BOX_F = np.array([
+    [0, 1, 3], [0, 3, 2],  [4, 6, 7], [4, 7, 5],   # -X, +X
+    [0, 4, 5], [0, 5, 1],  [2, 3, 7], [2, 7, 6],   # -Y, +Y
+    [0, 2, 6], [0, 6, 4],  [1, 5, 7], [1, 7, 3],   # -Z, +Z
+])
+
+def _axis_rot(axis: int, deg: float) -> np.ndarray:
+    # right-handed 3x3 rotation about a coordinate axis (0=X, 1=Y, 2=Z)
+    c, s = math.cos(math.radians(deg)), math.sin(math.radians(deg))
+    i, j = [(1, 2), (2, 0), (0, 1)][axis]
+    R = np.eye(3)
+    R[i, i], R[i, j], R[j, i], R[j, j] = c, -s, s, c
+    return R
+
+def _compose(scale=1.0, translate=(0.0, 0.0, 0.0), rot=None, pivot=(0.0, 0.0, 0.0)) -> np.ndarray:
+    # 4x4 for: per-axis scale, then translate, then rotate by `rot` (3x3) about pivot
+    M = np.eye(4)
+    M[:3, :3] *= scale                              # eye * per-axis scale == diag(scale)
+    M[:3, 3] = translate
+    if rot is not None:
+        R = np.eye(4)
+        R[:3, :3] = rot
+        R[:3, 3] = pivot - rot @ pivot
+        M = R @ M
+    return M
+
+@lru_cache(maxsize=16)
+def _spins(n: int, offset_deg: float = 0.0) -> np.ndarray:
+    # (n, 4, 4) stack of rotations about Z at offset + k*360/n, the polar array of
+    # _polar; like _rotations the trig runs once per (n, offset), read-only to share
+    a = math.radians(offset_deg) + np.arange(n)*(2*np.pi/n)
+    c, s = np.cos(a), np.sin(a)
+    M = np.zeros((n, 4, 4))
+    M[:, 0, 0], M[:, 0, 1], M[:, 1, 0], M[:, 1, 1] = c, -s, s, c
+    M[:, 2, 2] = M[:, 3, 3] = 1.0
+    M.flags.writeable = False
+    return M
+
+# orient Z->Y like build_stud: -90 deg about X is the exact permutation
+# (x, y, z) -> (x, z, -y), with no cos(90) round-off
+_ZY4 = _compose(rot=np.array([[1.0, 0, 0], [0, 0, 1.0], [0, -1.0, 0]]))
+
+for _n in (4, 6):  # the common prong counts: prong and strut angles, both builders
+    _spins(_n)
+    _spins(_n, 180.0/_n)
+    _rotations(_n)
+    _rotations(_n, 180.0/_n)
+
+def _mesh_plan(p: dict, lod: str = "med") -> list:
+    # every part is a unit template plus a (k, 4, 4) stack of placements, one per
+    # copy, Z up: build_stud_mesh flattens it, _glb_bytes instances it
+    d = _dims(p)
+    e = _LOD_CHORD[lod]
+    rim_n = _sections_for(d.rim_outer, e)
+    plan = []
+
+    # rim: one stepped annulus, the thinner band above the seat ledge; a single
+    # profile leaves no hidden caps where two stacked bands would overlap
+    lo, hi, zl = d.rim_inner/d.rim_outer, max(d.seat_r, d.rim_inner)/d.rim_outer, 1.0 - d.seat_drop/d.rim_h
+    profile = [(1.0, 0.0), (1.0, 1.0), (hi, 1.0)] + ([(hi, zl), (lo, zl)] if hi > lo else []) + [(lo, 0.0)]
+    plan.append((*_lathe_arrays(rim_n, profile), _compose((d.rim_outer, d.rim_outer, d.rim_h), (0, 0, d.rim_bot_z))[None]))
+
+    # gallery disc
+    plan.append((*_cyl_arrays(_sections_for(d.gal_r, e)), _compose((d.gal_r, d.gal_r, d.gallery_h), (0, 0, d.gal_bot_z))[None]))
+
+    # struts, halfway between prongs
+    M = _compose((d.strut_len, d.bridge_w, d.strut_h), (d.strut_x, 0, 0.5*(d.strut_z0 + d.strut_z1)))
+    plan.append((_BOX_V, _BOX_F, _spins(d.prong_n, 180.0/d.prong_n) @ M))
+
+    # prongs: tapered cylinder at the rim, tilted inward about the local tangent,
+    # stamped around Z as one batch
+    heel = (d.rim_outer, 0.0, d.heel_z)
+    M = _compose((d.heel_r, d.heel_r, d.prong_h), heel, _axis_rot(1, -d.prong_tilt), heel)
+    plan.append((*_cyl_arrays(_sections_for(d.heel_r, e), d.tip_r/d.heel_r), _spins(d.prong_n) @ M))
+
+    if d.add_cross:
+        for dims in ((d.rail_len, d.rail_w, d.rail_h), (d.rail_w, d.rail_len, d.rail_h)):
+            plan.append((_BOX_V, _BOX_F, _compose(dims, (0, 0, d.rail_z))[None]))
+
+    # post
+    plan.append((*_cyl_arrays(_sections_for(0.5*d.post_d, e)), _compose((0.5*d.post_d, 0.5*d.post_d, d.post_len), (0, 0, d.gal_bot_z))[None]))
+    return plan
+
+def build_stud_mesh(p: dict, lod: str = "med"):
+    # the plan fixes all sizes before any vertex is written (Z->Y folded in)
+    plan = _mesh_plan(p, lod)
+    # one batched matmul per template, written straight into preallocated buffers
+    V = np.empty((sum(len(Vu)*len(Ms) for Vu, _, Ms in plan), 3), np.float32)
+    F = np.empty((sum(len(Fu)*len(Ms) for _, Fu, Ms in plan), 3), np.int32)
+    v = f = 0
+    for Vu, Fu, Ms in plan:
+        Ms = (_ZY4 @ Ms).astype(np.float32)  # compose in float64, stream vertices in float32
+        k, nv, nf = len(Ms), len(Vu), len(Fu)
+        out = V[v:v + k*nv].reshape(k, nv, 3)
+        np.matmul(Vu, Ms[:, :3, :3].transpose(0, 2, 1), out=out)   # (nv,3) @ (k,3,3) -> (k,nv,3)
+        out += Ms[:, None, :3, 3]
+        np.add(Fu, (v + nv*np.arange(k))[:, None, None], out=F[f:f + k*nf].reshape(k, nf, 3), casting="unsafe")
+        v += k*nv
+        f += k*nf
+    return V, F
+
+for _lod in _LOD_CHORD:  # warm the templates the default design uses at every lod
+    build_stud_mesh({}, _lod)
 
 # -------------------- routes --------------------
 
+_HEALTH_BODY = orjson.dumps({"ok": True})
+
 @app.get("/health")
 def health():
-    return jsonify({"ok": True})
+    # Response objects are mutated per request (CORS headers), so only the body is shared
+    return Response(_HEALTH_BODY, mimetype="application/json")
+
+def _send_model(kind: str, mimetype: str, filename: str, params: dict = None) -> Response:
+    # params: the already parsed body, when the route had to read it first
+    params = _payload() if params is None else params
+    lod = params.pop("lod", None)
+    ua_lod = False
+    if kind != "stl":
+        params.pop("fuse", None)  # STEP and the zip are always fused, the preview never is
+    if kind in ("preview", "glb"):
+        params.pop("filletTips", None)  # the preview has no fillets or chamfers to gate
+    if kind == "step":
+        lod = None  # keep one STEP cache entry per design
+    elif not isinstance(lod, str) or lod not in _LOD:  # lists/dicts fall back too
+        lod = "low" if "Mobi" in request.headers.get("User-Agent", "") else "med"
+        ua_lod = True
+    # STEP text deflates best of all; the zip is deflated already. Quality matters:
+    # "gzip;q=0" is a refusal, which a substring test would read as a yes
+    gz = kind != "zip" and request.accept_encodings["gzip"] > 0
+    key = _params_key(params)
+    data, etag = (_cached_gzip if gz else _cached_export)(key, kind, lod)
+    weak = _fused(key, kind)
+    if request.if_none_match.contains_weak(etag):  # If-None-Match compares weakly
+        resp = Response(status=304)
+    else:
+        resp = Response(
+            data,
+            mimetype=mimetype,
+            headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+        )
+        if gz:
+            resp.headers["Content-Encoding"] = "gzip"
+    resp.set_etag(etag, weak=weak)
+    resp.vary.add("Accept-Encoding")
+    if ua_lod:
+        resp.vary.add("User-Agent")  # the default lod was picked from it
+    return resp
 
 @app.post("/api/generate")
 def api_generate():
-    params = request.get_json(silent=True) or {}
-    model = build_stud(params)
-    data = _export_bytes(model, "stl")
-    return Response(
-        data,
-        mimetype="application/octet-stream",
-        headers={"Content-Disposition": 'attachment; filename="stud.stl"'}
-    )
+    return _send_model("stl", "application/octet-stream", "stud.stl")
 
 @app.post("/api/generate/step")
 def api_generate_step():
-    params = request.get_json(silent=True) or {}
-    model = build_stud(params)
-    data = _export_bytes(model, "step")
-    return Response(
-        data,
-        mimetype="application/step",
-        headers={"Content-Disposition": 'attachment; filename="stud.step"'}
-    )
+    return _send_model("step", "application/step", "stud.step")
+
+@app.post("/api/generate/all")
+def api_generate_all():
+    return _send_model("zip", "application/zip", "stud.zip")
+
+@app.post("/api/generate/preview")
+def api_generate_preview():
+    params = _payload()
+    if params.get("format") == "glb":
+        return _send_model("glb", "model/gltf-binary", "stud-preview.glb", params)
+    return _send_model("preview", "application/octet-stream", "stud-preview.stl", params)
+
+# POST /admin/cache/clear with "Authorization: Bearer $STUD_ADMIN_TOKEN" drops the
+# memoised models and parts; without the env var the route answers 404. Caches are
+# per process, so this clears the gunicorn worker that takes the request
+_ADMIN_TOKEN = os.environ.get("STUD_ADMIN_TOKEN", "")
+_MODEL_CACHES = (_cached_export, _cached_gzip, _cached_solid,
+                 _rim_solid, _gallery_solid, _strut_unit, _post_solid, _prong_unit)
+
+@app.post("/admin/cache/clear")
+def admin_cache_clear():
+    if not _ADMIN_TOKEN:
+        return Response(status=404)
+    # bytes, not str: compare_digest rejects non-ASCII str with a TypeError (-> 500)
+    if not hmac.compare_digest(request.headers.get("Authorization", "").encode(), f"Bearer {_ADMIN_TOKEN}".encode()):
+        return Response(status=401)
+    cleared = sum(c.cache_info().currsize for c in _MODEL_CACHES)
+    for c in _MODEL_CACHES:
+        c.cache_clear()
+    return _json({"ok": True, "cleared": cleared})
+
+def _warmup():
+    # build + export the default design once so it is served from the caches and
+    # OCCT's first-use costs are paid at boot, not by a client. Called per worker
+    # right after the fork (gunicorn.conf.py), never in the preloading master.
+    # The key is canonical, so a client posting the full default spec hits these too
+    key = _params_key({})
+    for kind, lod in (("stl", "med"), ("step", None), ("preview", "med")):
+        _cached_export(key, kind, lod)
 
 if __name__ == "__main__":
+    if os.environ.get("WARMUP", "1") == "1":
+        _warmup()
     port = int(os.environ.get("PORT", "8080"))
     app.run(host="0.0.0.0", port=port, debug=False)
@@ -0,0 +1,28 @@
+# gunicorn.conf.py — production server settings
+#   gunicorn -c gunicorn.conf.py app:app
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+
+# OCP holds the GIL for CAD work, so scale with processes; the extra thread
+# only keeps a worker responsive for slow clients while a build runs. Builds
+# are CPU-bound, so the default is one worker per core, not 2*cores+1;
+# WEB_CONCURRENCY (set by most PaaS hosts) overrides it
+workers      = int(os.environ.get("WEB_CONCURRENCY", max(2, os.cpu_count() or 1)))
+worker_class = "gthread"
+threads      = 2
+timeout      = 60
+
+# import CadQuery/OCCT once in the master, along with the preview tables app.py
+# warms at import; workers share those pages copy-on-write
+preload_app  = True
+
+def post_worker_init(worker):
+    # build the default design once per worker so the first client request for it
+    # is a cache hit, whether it posts {} or spells every default out; runs after
+    # the fork, so no OCCT threads predate it.
+    # WARMUP=0 skips it (faster boots while developing)
+    if os.environ.get("WARMUP", "1") == "1":
+        import app
+        app._warmup()